@@ -1,41 +1,99 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import os
+import io
+import asyncio
+import zipfile
+import mmap
 import cv2
+import numpy as np
 import uvicorn
 from typing import List
-import shutil
+import tempfile
+from urllib.parse import quote
 from datetime import datetime
 
 # Local Modules
-from utils.solution1 import process_aadhar_image
+from utils.config import JPEG_QUALITY
+from utils.solution1 import OCR_CONCURRENCY, USE_GPU, process_aadhar_image, process_aadhar_images, warm_up_reader
 from utils.solution2 import mask_aadhaar
-from utils.genai_method import extract_aadhaar_with_gpt4, mask_aadhaar_number
+from utils.genai_method import extract_aadhaar_with_gpt4, find_aadhaar_with_ocr, mask_aadhaar_number
 
-# Setup directories
-TEMP_DIR = "temp"
-OUTPUT_DIR = "output"
+# Uploads larger than this are memory-mapped from their spool file instead of read into memory
+MMAP_THRESHOLD = 10 * 1024 * 1024
+
+# Most images accepted by one multi-image request
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", 20))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Create directories and cleanup old files
-    for dir_path in [TEMP_DIR, OUTPUT_DIR]:
-        os.makedirs(dir_path, exist_ok=True)
-        for file_name in os.listdir(dir_path):
-            file_path = os.path.join(dir_path, file_name)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-            except Exception as e:
-                print(f"Error deleting {file_path}: {e}")
+    # Shared pool for the blocking decode / OCR / encode work handed off with asyncio.to_thread
+    max_threads = int(os.getenv("OCR_NUM_THREADS", os.cpu_count() or 1))
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_threads))
+    # Load the OCR models once, before the first request arrives
+    warm_up_reader()
     yield
-    # Cleanup on shutdown
-    for dir_path in [TEMP_DIR, OUTPUT_DIR]:
-        try:
-            shutil.rmtree(dir_path)
-        except Exception as e:
-            print(f"Error cleaning up {dir_path}: {e}")
+
+
+def encode_jpeg(image) -> bytes:
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise HTTPException(status_code=500, detail="Failed to encode masked image")
+    return buffer.tobytes()
+
+
+def attachment_headers(filename: str) -> dict:
+    """Content-Disposition header for a download, quoting non-ASCII names like Starlette's FileResponse."""
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        return {"Content-Disposition": f"attachment; filename*=utf-8''{quoted_filename}"}
+    return {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+
+async def read_upload(file: UploadFile):
+    """Return the upload's bytes as a uint8 array, mapping large uploads rather than copying them."""
+    if file.size and file.size > MMAP_THRESHOLD:
+        # Large uploads are already spooled to disk, so map the file directly
+        file.file.seek(0)
+        return np.frombuffer(mmap.mmap(file.file.fileno(), 0, access=mmap.ACCESS_READ), np.uint8)
+    return np.frombuffer(await file.read(), np.uint8)
+
+
+class ZipStream(io.RawIOBase):
+    """Write-only, non-seekable sink for zipfile that hands back what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries):
+    """Yield a ZIP archive of (name, data) entries piece by piece, without building it in memory."""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as zip_file:
+        for name, data in entries:
+            zip_file.writestr(name, data)
+            yield stream.drain()
+    yield stream.drain()
+
 
 app = FastAPI(
     title="Aadhaar Card Masking API",
@@ -53,79 +111,66 @@ async def mask_aadhar_card(file: UploadFile = File(...)):
     
     try:
         # Read image file
-        image_data = await file.read()
+        image_data = await read_upload(file)
         
         # Process image
         masked_image = await process_aadhar_image(image_data)
-        output_filename = f"masked_aadhar_{file.filename}"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        # Save masked image
-        cv2.imwrite(output_path, masked_image)
-        
-        # Return masked image
-        return FileResponse(
-            output_path,
+        output_filename = f"masked_aadhar_{os.path.splitext(os.path.basename(file.filename))[0]}.jpg"
+
+        # Return masked image, encoded in memory
+        return Response(
+            content=encode_jpeg(masked_image),
             media_type="image/jpeg",
-            filename=output_filename
+            headers=attachment_headers(output_filename)
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# @app.post("/mask-multiple-aadhars/solution1/",
-#           summary="Mask multiple Aadhaar cards using Solution 1",
-#           description="Upload multiple Aadhaar card images to mask sensitive information using Solution 1")
-# async def mask_multiple_aadhar_cards(files: List[UploadFile] = File(...)):
-#     if not files:
-#         raise HTTPException(status_code=400, detail="No files provided")
-#
-#     try:
-#         masked_images = []
-#         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-#
-#         for idx, file in enumerate(files):
-#             if not file.content_type.startswith('image/'):
-#                 continue
-#
-#             image_data = await file.read()
-#             masked_image = await process_aadhar_image(image_data)
-#
-#             output_filename = f"masked_aadhar_{file.filename}"
-#             output_path = os.path.join(OUTPUT_DIR, output_filename)
-#
-#             cv2.imwrite(output_path, masked_image)
-#             masked_images.append(output_path)
-#
-#         if not masked_images:
-#             raise HTTPException(status_code=400, detail="No valid images processed")
-#
-#         # Create ZIP file containing all masked images
-#         zip_filename = f"masked_aadhars_{timestamp}.zip"
-#         zip_path = os.path.join(OUTPUT_DIR, zip_filename)
-#
-#         # Create a temporary directory for ZIP creation
-#         temp_zip_dir = os.path.join(TEMP_DIR, f"zip_{timestamp}")
-#         os.makedirs(temp_zip_dir, exist_ok=True)
-#
-#         # Copy masked images to temporary directory
-#         for img_path in masked_images:
-#             shutil.copy2(img_path, temp_zip_dir)
-#
-#         # Create ZIP file
-#         shutil.make_archive(zip_path[:-4], 'zip', temp_zip_dir)
-#
-#         # Cleanup temporary directory
-#         shutil.rmtree(temp_zip_dir)
-#
-#         return FileResponse(
-#             zip_path,
-#             media_type="application/zip",
-#             filename=zip_filename
-#         )
-#
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=str(e))
+@app.post("/mask-multiple-aadhars/solution1/",
+          summary="Mask multiple Aadhaar cards using Solution 1",
+          description="Upload multiple Aadhaar card images to mask sensitive information using Solution 1")
+async def mask_multiple_aadhar_cards(files: List[UploadFile] = File(...)):
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+    if len(files) > MAX_UPLOAD_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_UPLOAD_FILES} files can be processed at once")
+
+    try:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        image_files = [file for file in files if file.content_type.startswith('image/')]
+        if not image_files:
+            raise HTTPException(status_code=400, detail="No valid images processed")
+
+        # Read, OCR, mask and encode OCR_CONCURRENCY images at a time, so only one slice is decoded at once
+        jpegs = []
+        for offset in range(0, len(image_files), OCR_CONCURRENCY):
+            images_data = await asyncio.gather(*[read_upload(file)
+                                                 for file in image_files[offset:offset + OCR_CONCURRENCY]])
+            processed_images = await process_aadhar_images(images_data)
+            jpegs += await asyncio.gather(*[asyncio.to_thread(encode_jpeg, image) for image in processed_images])
+
+        # Stream the ZIP as it is built; JPEGs are already compressed, so store them as-is.
+        # The index keeps entries unique when uploads share a name.
+        zip_filename = f"masked_aadhars_{timestamp}.zip"
+        entries = [
+            (f"masked_aadhar_{idx}_{os.path.splitext(os.path.basename(file.filename))[0]}.jpg", jpeg)
+            for idx, (file, jpeg) in enumerate(zip(image_files, jpegs))
+        ]
+
+        return StreamingResponse(
+            stream_zip(entries),
+            media_type="application/zip",
+            headers=attachment_headers(zip_filename)
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/mask-aadhar/solution2/",
@@ -139,22 +184,27 @@ async def mask_aadhar_solution2(file: UploadFile = File(...)):
         # Read image file
         image_data = await file.read()
 
-        # Process image
-        image_path = os.path.join(TEMP_DIR, file.filename)
-        output_path = os.path.join(OUTPUT_DIR, f"masked_{file.filename}")
-        with open(image_path, "wb") as f:
-            f.write(image_data)
+        # Process image in a per-request scratch directory, removed once the result is read back
+        file_name = os.path.basename(file.filename)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = os.path.join(temp_dir, file_name)
+            output_path = os.path.join(temp_dir, f"masked_{file_name}")
+            with open(image_path, "wb") as f:
+                f.write(image_data)
+
+            masked_image_path = mask_aadhaar(image_path=image_path, output_path=output_path)
 
-        masked_image_path = mask_aadhaar(image_path=image_path, output_path=output_path)
+            if not masked_image_path:
+                raise HTTPException(status_code=400, detail="No Aadhaar numbers found in the image")
 
-        if not masked_image_path:
-            raise HTTPException(status_code=400, detail="No Aadhaar numbers found in the image")
+            with open(masked_image_path, "rb") as f:
+                masked_image = f.read()
 
         # Return masked image
-        return FileResponse(
-            masked_image_path,
+        return Response(
+            content=masked_image,
             media_type="image/jpeg",
-            filename=os.path.basename(masked_image_path)
+            headers=attachment_headers(f"masked_{file_name}")
         )
 
     except Exception as e:
@@ -229,29 +279,50 @@ async def mask_aadhar_genai(file: UploadFile = File(...)):
         # Read image file
         image_data = await file.read()
 
-        # Process image
-        image_path = os.path.join(TEMP_DIR, file.filename)
-        output_path = os.path.join(OUTPUT_DIR, f"masked_{file.filename}")
-        with open(image_path, "wb") as f:
-            f.write(image_data)
+        # Process image in a per-request scratch directory, removed once the result is read back
+        file_name = os.path.basename(file.filename)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = os.path.join(temp_dir, file_name)
+            output_path = os.path.join(temp_dir, f"masked_{file_name}")
+            with open(image_path, "wb") as f:
+                f.write(image_data)
+
+            # Extract Aadhaar number, only calling GPT-4o when local OCR doesn't find it
+            local_candidate, ocr_data = find_aadhaar_with_ocr(image_path)
+            aadhaar_number = extract_aadhaar_with_gpt4(image_path, local_candidate=local_candidate)
+            if not aadhaar_number:
+                raise HTTPException(status_code=400, detail="No Aadhaar number found in the image")
 
-        # Extract Aadhaar number
-        aadhaar_number = extract_aadhaar_with_gpt4(image_path)
-        if not aadhaar_number:
-            raise HTTPException(status_code=400, detail="No Aadhaar number found in the image")
+            # Mask Aadhaar number
+            mask_aadhaar_number(image_path, aadhaar_number, output_path, ocr_data=ocr_data)
 
-        # Mask Aadhaar number
-        mask_aadhaar_number(image_path, aadhaar_number, output_path)
+            with open(output_path, "rb") as f:
+                masked_image = f.read()
 
         # Return masked image
-        return FileResponse(
-            output_path,
+        return Response(
+            content=masked_image,
             media_type="image/jpeg",
-            filename=os.path.basename(output_path)
+            headers=attachment_headers(f"masked_{file_name}")
         )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Each worker loads its own OCR models in lifespan; keep a single worker when they'd share one GPU
+    workers = int(os.getenv("WEB_CONCURRENCY", 1 if USE_GPU else os.cpu_count() or 1))
+    # Share the cores between workers instead of every worker sizing its OCR threads to all of them.
+    # Workers import the app afresh and pick these up.
+    threads_per_worker = str(max(1, (os.cpu_count() or 1) // workers))
+    os.environ.setdefault("OCR_NUM_THREADS", threads_per_worker)
+    os.environ.setdefault("TESSERACT_POOL_SIZE", threads_per_worker)
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=100
+    )
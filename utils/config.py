@@ -0,0 +1,5 @@
+# JPEG quality for masked images, whether returned from memory or saved to disk
+JPEG_QUALITY = 90
+
+# Digits of the Aadhaar number that get masked (the last 4 stay visible)
+MASKED_DIGITS = 8
@@ -1,20 +1,35 @@
 import os
 import base64
 import requests
-from PIL import Image, ImageDraw
+import cv2
 from dotenv import load_dotenv
-import pytesseract
+
+# Local Modules
+from utils.config import JPEG_QUALITY
+from utils.patterns import SPACED_AADHAAR_REGEX
+from utils.tesseract import find_numbers, image_to_data, PSM
 
 load_dotenv()
 api_key = os.getenv('OPENAI_API_KEY')
 
+# Reused across calls so the TLS connection to the API is kept alive
+session = requests.Session()
+REQUEST_TIMEOUT = (3, 10)  # (connect, read) seconds
+
+# Bytes read per step when base64-encoding images
+ENCODE_CHUNK_SIZE = 57 * 1024
+
 def encode_image(image_path):
     """
     Encode image to base64 string
     """
     try:
+        # Encode in chunks that are a multiple of 3 bytes so no padding lands mid-stream
+        chunks = []
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            while chunk := image_file.read(ENCODE_CHUNK_SIZE):
+                chunks.append(base64.b64encode(chunk))
+        return b"".join(chunks).decode('ascii')
     except FileNotFoundError:
         print(f"Error: Image file not found at path: {image_path}")
         return None
@@ -23,10 +38,34 @@ def encode_image(image_path):
         return None
 
 
-def extract_aadhaar_with_gpt4(image_path):
+def ocr_digits(image):
+    """
+    Run Tesseract for digits only: English model, sparse-text segmentation and a
+    digit whitelist, which is all that is needed to locate the Aadhaar number.
+    """
+    return image_to_data(image, lang='eng', psm=PSM.SPARSE_TEXT, whitelist="0123456789")
+
+
+def find_aadhaar_with_ocr(image_path):
     """
-    Extract Aadhaar number using GPT-4 Vision API
+    Look for the Aadhaar number with local OCR.
+    Returns the number (or None) along with the OCR data, so it can be reused for masking.
     """
+    data = ocr_digits(cv2.imread(image_path))
+
+    # Only trust a number whose words were all read confidently; otherwise ask GPT-4o
+    numbers = find_numbers(data, SPACED_AADHAAR_REGEX)
+    return (numbers[0][0] if numbers else None), data
+
+
+def extract_aadhaar_with_gpt4(image_path, local_candidate=None):
+    """
+    Extract Aadhaar number using GPT-4 Vision API.
+    If local OCR already found a valid number, it is returned without calling the API.
+    """
+    if local_candidate and SPACED_AADHAAR_REGEX.fullmatch(local_candidate):
+        return local_candidate
+
     base64_image = encode_image(image_path)
     if not base64_image:
         return None
@@ -59,10 +98,11 @@ def extract_aadhaar_with_gpt4(image_path):
     }
 
     try:
-        response = requests.post(
+        response = session.post(
             "https://api.openai.com/v1/chat/completions",
             headers=headers,
-            json=payload
+            json=payload,
+            timeout=REQUEST_TIMEOUT
         )
 
         if response.status_code != 200:
@@ -86,32 +126,31 @@ def extract_aadhaar_with_gpt4(image_path):
 
 
 
-def mask_aadhaar_number(image_path, aadhaar_number, output_path):
-    aadhaar_number_digits = aadhaar_number.split(" ")[0:2]
+def mask_aadhaar_number(image_path, aadhaar_number, output_path, ocr_data=None):
+    # First 8 digits, as the groups OCR reports them
+    aadhaar_number_digits = set(aadhaar_number.split(" ")[0:2])
 
-    image = Image.open(image_path)
+    image = cv2.imread(image_path)
+    if image is None:
+        print(f"Error: Could not read image at path: {image_path}")
+        return False
 
-    # Extract data from the image using pytesseract
-    data = pytesseract.image_to_data(image, lang='eng+hin', output_type=pytesseract.Output.DICT)
+    # Extract data from the image using Tesseract, unless it was already done
+    data = ocr_data if ocr_data is not None else ocr_digits(image)
 
-    # Locate the Aadhaar number's bounding box
+    # Locate the Aadhaar number's bounding box and black it out in place
     aadhaar_coordinates = None
 
-    image_with_mask = image.copy()
-
     for i, text in enumerate(data['text']):
-        for digit in range(len(aadhaar_number_digits) * 2):
-            if text.strip() in aadhaar_number_digits:
-                # Get bounding box coordinates
-                x, y, w, h = data['left'][i], data['top'][i], data['width'][i], data['height'][i]
-                aadhaar_coordinates = (x, y, x + w, y + h)
-                draw = ImageDraw.Draw(image_with_mask)
-                draw.rectangle(aadhaar_coordinates, fill="black")
-            break
+        if text.strip() in aadhaar_number_digits:
+            # Get bounding box coordinates
+            x, y, w, h = data['left'][i], data['top'][i], data['width'][i], data['height'][i]
+            aadhaar_coordinates = (x, y, x + w, y + h)
+            image[y:y + h + 1, x:x + w + 1] = 0
 
     # If Aadhaar number is found, mask it
     if aadhaar_coordinates:
-        image_with_mask.save(output_path)
+        cv2.imwrite(output_path, image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
 
         print(f"Aadhaar number masked successfully! Saved to {output_path}")
         return True
@@ -0,0 +1,11 @@
+import re
+
+# Aadhaar number: 12 digits, grouped 4-4-4 with optional single spaces
+AADHAAR_REGEX = re.compile(r"\b\d{4}\s?\d{4}\s?\d{4}\b")
+
+# Same, but not part of a longer digit run such as a 16-digit VID
+STANDALONE_AADHAAR_REGEX = re.compile(r"(?<!\d\s)\b\d{4}\s?\d{4}\s?\d{4}(?!\s?\d)")
+
+# Aadhaar number as printed on the card (4 digits, space, 4 digits, space, 4 digits), not part
+# of a longer digit run such as a 16-digit VID
+SPACED_AADHAAR_REGEX = re.compile(r"(?<!\d\s)\b\d{4}\s\d{4}\s\d{4}(?!\s?\d)")
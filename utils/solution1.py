@@ -1,88 +1,290 @@
 from fastapi import HTTPException
 import numpy as np
-import pytesseract
-import re
 import easyocr
 import cv2
 import os
+import math
 import asyncio
+import threading
+import torch
+from typing import List
 
+try:
+    from turbojpeg import TurboJPEG
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    # PyTurboJPEG or libturbojpeg isn't installed; decode everything with OpenCV
+    _turbo_jpeg = None
+
+# Local Modules
+from utils.config import JPEG_QUALITY, MASKED_DIGITS
+from utils.patterns import AADHAAR_REGEX, STANDALONE_AADHAAR_REGEX
+from utils.tesseract import find_numbers, image_to_data
+
+# JPEG start-of-image marker, and the EXIF header that may carry an orientation tag
+JPEG_MAGIC = b"\xff\xd8"
+EXIF_MARKER = b"Exif\x00\x00"
+EXIF_SEARCH_BYTES = 64 * 1024
+
+# Longest side images are scaled down to before single-image OCR
+OCR_MAX_SIDE = 1280
+
+# Common size images are resized to for batched OCR
+BATCH_WIDTH = 800
+BATCH_HEIGHT = 600
+
+# Only digits matter for masking: restrict the recognizer to them and batch all text boxes
+READTEXT_OPTIONS = dict(
+    allowlist='0123456789 ',
+    batch_size=32,
+    workers=0,
+    paragraph=False,
+    low_text=0.3,
+    text_threshold=0.5
+)
+
+# Share of the number's box that is masked (the first MASKED_DIGITS of 12 digits)
+MASK_FRACTION = MASKED_DIGITS / 12
+
+# Most images OCR'd in one batch (and folder images decoded at once by process_folder)
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", os.cpu_count() or 1))
+
+# Run OCR on the GPU when one is available
+USE_GPU = torch.cuda.is_available()
+
+# EasyOCR reader, loaded once per process and shared by every request
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader():
+    """Return the shared EasyOCR reader, loading the models on first use."""
+    global _reader
+    if _reader is None:
+        # Requests run OCR from worker threads; make sure only one of them loads the models
+        with _reader_lock:
+            if _reader is None:
+                if not USE_GPU and os.getenv('OCR_NUM_THREADS'):
+                    # Pin the CPU inference threads for the CRAFT/CRNN models
+                    torch.set_num_threads(int(os.getenv('OCR_NUM_THREADS')))
+                # quantize: on CPU, EasyOCR runs the detector/recognizer with dynamic INT8 weights
+                _reader = easyocr.Reader(['en'], gpu=USE_GPU, quantize=True, cudnn_benchmark=USE_GPU)
+    return _reader
 
-async def process_aadhar_image(image_data: bytes):
-    try:
-        # Convert bytes to numpy array
-        np_arr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
 
-        if image is None:
-            raise HTTPException(status_code=400, detail="Invalid image data")
+def warm_up_reader():
+    """Run dummy images through the reader so the first request doesn't pay model setup."""
+    reader = get_reader()
+    reader.readtext(np.zeros((BATCH_HEIGHT, BATCH_WIDTH, 3), np.uint8), **READTEXT_OPTIONS)
+    reader.readtext_batched(np.zeros((2, BATCH_HEIGHT, BATCH_WIDTH, 3), np.uint8), **READTEXT_OPTIONS)
 
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
+def decode_image(image_data: bytes):
+    # Convert bytes to numpy array
+    np_arr = np.frombuffer(image_data, np.uint8)
+    image = None
+
+    # libjpeg-turbo is much faster on JPEGs, but ignores EXIF orientation, which OpenCV applies
+    is_plain_jpeg = (np_arr[:2].tobytes() == JPEG_MAGIC
+                     and EXIF_MARKER not in np_arr[:EXIF_SEARCH_BYTES].tobytes())
+    if _turbo_jpeg is not None and is_plain_jpeg:
         try:
-            reader = easyocr.Reader(['en'])
-            results = reader.readtext(image)
-        except Exception as e:
-            # Fallback to pytesseract
-            results = []
-            try:
-                pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
-                text_data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-                for i, word in enumerate(text_data["text"]):
-                    if int(text_data["conf"][i]) > 60:
-                        (x, y, w, h) = (text_data["left"][i], text_data["top"][i],
-                                        text_data["width"][i], text_data["height"][i])
-                        results.append([((x, y), (x + w, y + h)), word, text_data["conf"][i]])
-            except Exception as e:
-                raise HTTPException(status_code=500,
-                                    detail=f"Error during image processing: {str(e)}")
-
-        masked_image = image.copy()
-        for result in results:
-            if isinstance(result, tuple):
-                bbox, text, prob = result
-                if re.match(r'\b\d{12}\b', text) or re.match(r'\d{4}\s\d{4}\s\d{4}', text):
-                    (top_left, top_right, bottom_right, bottom_left) = bbox
-                    top_left = (int(top_left[0]), int(top_left[1]))
-                    bottom_right = (int(bottom_right[0]), int(bottom_right[1]))
-                    text_width = bottom_right[0] - top_left[0]
-                    new_bottom_right = (top_left[0] + int(0.66 * text_width), bottom_right[1])
-                    cv2.rectangle(masked_image, top_left, new_bottom_right, (0, 0, 0), -1)
-            elif isinstance(result, list) and len(result) >= 3:
-                bbox, text, prob = result
-                if re.match(r'\b\d{12}\b', text) or re.match(r'\d{4}\s\d{4}\s\d{4}', text):
-                    top_left = (int(bbox[0][0]), int(bbox[0][1]))
-                    bottom_right = (int(bbox[1][0]), int(bbox[1][1]))
-                    text_width = bottom_right[0] - top_left[0]
-                    new_bottom_right = (top_left[0] + int(0.66 * text_width), bottom_right[1])
-                    cv2.rectangle(masked_image, top_left, new_bottom_right, (0, 0, 0), -1)
-
-        return masked_image
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+            image = _turbo_jpeg.decode(np_arr)
+        except Exception:
+            pass  # Not decodable by libjpeg-turbo; OpenCV gets a go below
+
+    if image is None:
+        image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+    if image is None:
+        raise HTTPException(status_code=400, detail="Invalid image data")
+    return image
+
+
+def tesseract_results(image):
+    """
+    Fallback OCR with Tesseract, returning Aadhaar number candidates in the same
+    (4-point bbox, text, conf) shape as EasyOCR, with one box around all words of a number.
+    """
+    text_data = image_to_data(image)
+
+    results = []
+    for text, (first, last), conf in find_numbers(text_data, STANDALONE_AADHAAR_REGEX):
+        words = range(first, last + 1)
+        x1 = min(text_data["left"][i] for i in words)
+        y1 = min(text_data["top"][i] for i in words)
+        x2 = max(text_data["left"][i] + text_data["width"][i] for i in words)
+        y2 = max(text_data["top"][i] + text_data["height"][i] for i in words)
+        bbox = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+        results.append((bbox, text, conf))
+    return results
+
+
+def fill_black_quad(image, bbox):
+    """
+    Black out the leading part of a (possibly skewed) 4-point text box, following the
+    box's own edges so rotated numbers are fully covered.
+    """
+    top_left, top_right, bottom_right, bottom_left = (np.asarray(point, dtype=np.float32) for point in bbox)
+    quad = np.array([
+        top_left,
+        top_left + MASK_FRACTION * (top_right - top_left),
+        bottom_left + MASK_FRACTION * (bottom_right - bottom_left),
+        bottom_left
+    ])
+    cv2.fillConvexPoly(image, np.round(quad).astype(np.int32), (0, 0, 0))
+
+
+def mask_from_results(image, results):
+    """Black out Aadhaar numbers found in the OCR results, drawing in place on the decoded image."""
+    for bbox, text, prob in results:
+        if len(text) >= 12 and AADHAAR_REGEX.search(text):
+            fill_black_quad(image, bbox)
+
+    return image
+
+
+def detect_text(image):
+    """
+    Run EasyOCR on a copy of the image scaled down to OCR_MAX_SIDE, which is plenty for
+    reading the number, and return the boxes in the original image's coordinates.
+    """
+    scale = min(1.0, OCR_MAX_SIDE / max(image.shape[:2]))
+    if scale == 1.0:
+        return get_reader().readtext(image, **READTEXT_OPTIONS)
+
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    results = get_reader().readtext(small, **READTEXT_OPTIONS)
+    return [
+        ([[x / scale, y / scale] for x, y in bbox], text, prob)
+        for bbox, text, prob in results
+    ]
+
+
+def detect_text_batched(images, size=(BATCH_WIDTH, BATCH_HEIGHT)):
+    """
+    Run the EasyOCR detector/recognizer over all images in a single batched pass.
+    Images are resized to a common (width, height) for the batch, so the boxes are
+    scaled back to each image's own coordinates before being returned.
+    """
+    batch_width, batch_height = size
+    try:
+        batch_results = get_reader().readtext_batched(images, n_width=batch_width, n_height=batch_height,
+                                                         **READTEXT_OPTIONS)
+    except Exception:
+        # Fallback to Tesseract, one image at a time
+        return [tesseract_results(image) for image in images]
+
+    scaled_results = []
+    for image, results in zip(images, batch_results):
+        height, width = image.shape[:2]
+        sx, sy = width / batch_width, height / batch_height
+        scaled_results.append([
+            ([[x * sx, y * sy] for x, y in bbox], text, prob)
+            for bbox, text, prob in results
+        ])
+    return scaled_results
+
+
+def batch_size_for(image):
+    """
+    Common batch size for OCR'ing images shaped like this one: about the area of
+    BATCH_WIDTH x BATCH_HEIGHT, with the aspect ratio rounded to a quarter so similar
+    images share a batch without being noticeably stretched.
+    """
+    height, width = image.shape[:2]
+    ratio = min(max(round(width / height * 4) / 4, 0.25), 4.0)
+    batch_height = max(32, round(math.sqrt(BATCH_WIDTH * BATCH_HEIGHT / ratio) / 32) * 32)
+    batch_width = max(32, round(batch_height * ratio / 32) * 32)
+    return batch_width, batch_height
+
+
+def detect_text_grouped(images):
+    """
+    Run batched OCR over images of any shapes. Similarly shaped images share a batch
+    size (batch_size_for), and each group goes through detect_text_batched at most
+    OCR_CONCURRENCY images at a time, keeping the detector batch bounded. Results come
+    back in the order of the images.
+    """
+    groups = {}
+    for index, image in enumerate(images):
+        groups.setdefault(batch_size_for(image), []).append(index)
+
+    all_results = [None] * len(images)
+    for size, indices in groups.items():
+        for offset in range(0, len(indices), OCR_CONCURRENCY):
+            chunk = indices[offset:offset + OCR_CONCURRENCY]
+            for index, results in zip(chunk, detect_text_batched([images[i] for i in chunk], size)):
+                all_results[index] = results
+    return all_results
+
+
+def mask_aadhar_image(image_data: bytes):
+    """Decode, OCR and mask a single image. Blocking; run it in a worker thread from async code."""
+    image = decode_image(image_data)
+
+    try:
+        results = detect_text(image)
+    except Exception:
+        results = tesseract_results(image)
+
+    return mask_from_results(image, results)
+
+
+def decode_file(image_path: str):
+    """Same as decode_image, reading the file straight into a NumPy buffer."""
+    return decode_image(np.fromfile(image_path, dtype=np.uint8))
+
+
+def mask_and_save(image, results, output_path: str):
+    """Mask the image and write it to output_path, encoded in the format its extension names."""
+    processed_image = mask_from_results(image, results)
+    ok, buffer = cv2.imencode(os.path.splitext(output_path)[1], processed_image,
+                              [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError(f"Failed to encode {output_path}")
+    buffer.tofile(output_path)
+
+
+async def process_aadhar_image(image_data: bytes):
+    # Decoding and OCR are CPU-bound; keep them off the event loop
+    return await asyncio.to_thread(mask_aadhar_image, image_data)
+
+
+async def process_aadhar_images(images_data: List[bytes]):
+    # Decode and mask images in parallel threads; OCR runs in batches of similarly shaped images
+    images = await asyncio.gather(*[asyncio.to_thread(decode_image, image_data) for image_data in images_data])
+    batch_results = await asyncio.to_thread(detect_text_grouped, images)
+    return await asyncio.gather(*[asyncio.to_thread(mask_from_results, image, results)
+                                  for image, results in zip(images, batch_results)])
+
 
 async def process_folder(input_folder: str, output_folder: str):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
     image_extensions = {".png", ".jpg", ".jpeg"}
-    image_files = [f for f in os.listdir(input_folder) if os.path.splitext(f)[1].lower() in image_extensions]
+    with os.scandir(input_folder) as entries:
+        image_files = [entry.name for entry in entries
+                       if entry.is_file() and os.path.splitext(entry.name)[1].lower() in image_extensions]
 
     if not image_files:
         print("No valid image files found in the folder.")
         return
 
-    tasks = []
-    for image_file in image_files:
-        image_path = os.path.join(input_folder, image_file)
-        output_path = os.path.join(output_folder, image_file)
-
-        with open(image_path, "rb") as f:
-            image_data = f.read()
+    # Work through the folder OCR_CONCURRENCY images at a time, OCR'ing similarly shaped images together
+    for offset in range(0, len(image_files), OCR_CONCURRENCY):
+        batch_files = image_files[offset:offset + OCR_CONCURRENCY]
+        images = await asyncio.gather(*[asyncio.to_thread(decode_file, os.path.join(input_folder, image_file))
+                                        for image_file in batch_files])
+        batch_results = await asyncio.to_thread(detect_text_grouped, images)
 
-        processed_image = await process_aadhar_image(image_data)
-        cv2.imwrite(output_path, processed_image)
-        print(f"Processed and saved: {output_path}")
+        # Encode and write in worker threads so the event loop is free for the next batch
+        output_paths = [os.path.join(output_folder, image_file) for image_file in batch_files]
+        await asyncio.gather(*[asyncio.to_thread(mask_and_save, image, results, output_path)
+                               for image, results, output_path in zip(images, batch_results, output_paths)])
+        for output_path in output_paths:
+            print(f"Processed and saved: {output_path}")
 
     print("Processing completed for all Aadhaar cards.")
 
@@ -1,52 +1,65 @@
-import pytesseract
-from PIL import Image, ImageDraw
 import cv2
-import re
+import numpy as np
 import os
 import glob
+from concurrent.futures import ProcessPoolExecutor
 
-# Aadhaar number pattern (4 digits, space, 4 digits, space, 4 digits)
-AADHAAR_REGEX = re.compile(r"\b\d{4}\s\d{4}\s\d{4}\b")
+# Local Modules
+from utils.config import JPEG_QUALITY, MASKED_DIGITS
+from utils.patterns import AADHAAR_REGEX
+from utils.tesseract import image_to_data
 
 
-def preprocess_image(image_path):
-    """Preprocess the image to improve OCR accuracy."""
-    image = cv2.imread(image_path)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, thresh = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-    return thresh
+def preprocess_image(image):
+    """
+    Convert the image to grayscale for OCR. It is not binarized: Tesseract's LSTM engine
+    does its own thresholding and reads plain grayscale more reliably.
+    """
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
 
 def extract_text_and_bboxes(image_path):
-    """Extract Aadhaar numbers and their bounding boxes using Tesseract OCR."""
-    preprocessed_image = preprocess_image(image_path)
-    ocr_data = pytesseract.image_to_data(preprocessed_image, output_type=pytesseract.Output.DICT)
+    """
+    Extract Aadhaar numbers and their bounding boxes using Tesseract OCR.
+    Also returns the decoded image, so callers can mask it without reading the file again.
+    """
+    image = cv2.imread(image_path)
+    ocr_data = image_to_data(preprocess_image(image))
+
+    words = ocr_data["text"]
+    word_array = np.array(words, dtype=str)
+    left = np.asarray(ocr_data["left"])
+    top = np.asarray(ocr_data["top"])
+    right = left + np.asarray(ocr_data["width"])
+    bottom = top + np.asarray(ocr_data["height"])
+
+    # Find the runs of consecutive digit-only tokens
+    is_digit = np.char.isdigit(word_array).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], is_digit, [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
 
     texts, bboxes = [], []
-    current_tokens, current_bboxes = [], []
-
-    for i, word in enumerate(ocr_data["text"]):
-        if word.strip() and word.isdigit():
-            current_tokens.append(word)
-            current_bboxes.append([
-                ocr_data["left"][i],
-                ocr_data["top"][i],
-                ocr_data["left"][i] + ocr_data["width"][i],
-                ocr_data["top"][i] + ocr_data["height"][i]
+    for start, end in zip(run_starts, run_ends):
+        combined_text = " ".join(words[start:end])
+        if AADHAAR_REGEX.fullmatch(combined_text):
+            print(f"Found Aadhaar number: {combined_text}")
+            texts.append(combined_text)
+            # Cover the first 8 digits; the token holding the 8th digit is covered in proportion
+            run = slice(start, end)
+            lengths = np.char.str_len(word_array[run])
+            digits_before = np.cumsum(lengths) - lengths
+            share = np.clip((MASKED_DIGITS - digits_before) / lengths, 0, 1)
+            covered = share > 0
+            masked_right = left[run] + share * (right[run] - left[run])
+            bboxes.append([
+                int(left[run][covered].min()),
+                int(top[run][covered].min()),
+                int(masked_right[covered].max()),
+                int(bottom[run][covered].max())
             ])
-        else:
-            combined_text = " ".join(current_tokens)
-            if AADHAAR_REGEX.fullmatch(combined_text):
-                print(f"Found Aadhaar number: {combined_text}")
-                texts.append(combined_text)
-                x1 = min(bbox[0] for bbox in current_bboxes[:2])  # First 8 digits
-                y1 = min(bbox[1] for bbox in current_bboxes[:2])
-                x2 = max(bbox[2] for bbox in current_bboxes[:2])
-                y2 = max(bbox[3] for bbox in current_bboxes[:2])
-                bboxes.append([x1, y1, x2, y2])
-            current_tokens, current_bboxes = [], []
 
-    return texts, bboxes
+    return texts, bboxes, image
 
 
 def mask_aadhaar(image_path, output_path=None):
@@ -55,19 +68,25 @@ def mask_aadhaar(image_path, output_path=None):
         os.makedirs("../temp/sol_2", exist_ok=True)
         output_path = f"../temp/sol_2/masked_{os.path.basename(image_path)}"
 
-    texts, bboxes = extract_text_and_bboxes(image_path)
+    texts, bboxes, image = extract_text_and_bboxes(image_path)
     if not texts:
         return None
 
-    image = Image.open(image_path)
-    draw = ImageDraw.Draw(image)
-    for bbox in bboxes:
-        draw.rectangle(bbox, fill="black")
+    for x1, y1, x2, y2 in bboxes:
+        image[y1:y2 + 1, x1:x2 + 1] = 0
 
-    image.save(output_path)
+    cv2.imwrite(output_path, image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
     return output_path
 
 
+def mask_aadhaar_safely(image_path):
+    """Run mask_aadhaar in a worker process, returning (output_path, error) instead of raising."""
+    try:
+        return mask_aadhaar(image_path), None
+    except Exception as e:
+        return None, str(e)
+
+
 def process_images_in_folder(folder_path):
     image_extensions = ["*.jpg", "*.jpeg", "*.png"]  # Add other extensions if needed
     image_paths = []
@@ -80,15 +99,15 @@ def process_images_in_folder(folder_path):
         print("No images found in the folder.")
         return
 
-    for image_path in image_paths:
-        try:
-            output_path = mask_aadhaar(image_path)
-            if output_path:
+    # Single-threaded Tesseract in one process per core scales far better than its own threading
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for image_path, (output_path, error) in zip(image_paths, executor.map(mask_aadhaar_safely, image_paths)):
+            if error:
+                print(f"Error processing {image_path}: {error}")
+            elif output_path:
                 print(f"Masked image saved as: {output_path}")
             else:
                 print(f"No Aadhaar numbers found in the image: {image_path}")
-        except Exception as e:
-            print(f"Error processing {image_path}: {e}")
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,122 @@
+import os
+import bisect
+import queue
+import threading
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from PIL import Image
+
+# Tesseract's OpenMP threading only slows things down when several requests OCR at once.
+# Must be set before libtesseract is loaded.
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+from tesserocr import PyTessBaseAPI, PSM, RIL, iterate_level
+
+# Max libtesseract instances per (language, page segmentation mode); each OCRs one image at a time
+TESSERACT_POOL_SIZE = int(os.getenv('TESSERACT_POOL_SIZE', os.cpu_count() or 1))
+
+# Stands in for line starts when OCR'd words are joined for pattern matching
+LINE_BREAK = "|"
+
+# Idle instances, and slots capping instances in use, per (language, page segmentation mode)
+_idle_apis = {}
+_api_slots = {}
+_pools_lock = threading.Lock()
+
+
+@contextmanager
+def borrow_api(lang='eng', psm=PSM.AUTO):
+    """
+    Check a Tesseract API out of the pool for exclusive use (libtesseract isn't thread-safe).
+    At most TESSERACT_POOL_SIZE instances are in use at once; an idle one is reused when
+    available, otherwise a new one is created. The slot is given back even if creating the
+    instance fails, so waiting threads are never left stuck.
+    """
+    key = (lang, psm)
+    with _pools_lock:
+        idle = _idle_apis.setdefault(key, queue.LifoQueue())
+        slots = _api_slots.setdefault(key, threading.BoundedSemaphore(TESSERACT_POOL_SIZE))
+
+    slots.acquire()
+    try:
+        try:
+            api = idle.get_nowait()
+        except queue.Empty:
+            # Holding a slot with nothing idle means fewer than TESSERACT_POOL_SIZE instances exist
+            api = PyTessBaseAPI(lang=lang, psm=psm)
+
+        try:
+            yield api
+        finally:
+            idle.put(api)
+    finally:
+        slots.release()
+
+
+def image_to_data(image, lang='eng', psm=PSM.AUTO, whitelist=''):
+    """
+    In-process equivalent of pytesseract.image_to_data(..., output_type=Output.DICT).
+    Accepts a PIL image or an OpenCV (BGR / grayscale) array and returns a dict of lists
+    with text, conf, left, top, width and height for every word. Like pytesseract, an
+    empty entry with conf -1 precedes each text line.
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 3:
+            # Tesseract works on grayscale anyway; converting once here hands it a third of the bytes
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image = Image.fromarray(image)
+
+    data = {"text": [], "conf": [], "left": [], "top": [], "width": [], "height": []}
+
+    with borrow_api(lang, psm) as api:
+        api.SetVariable("tessedit_char_whitelist", whitelist)
+        api.SetImage(image)
+        api.Recognize()
+        iterator = api.GetIterator()
+        if iterator is None:
+            return data
+
+        for word in iterate_level(iterator, RIL.WORD):
+            bbox = word.BoundingBox(RIL.WORD)
+            if bbox is None:
+                continue
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                _append_word(data, "", -1, (0, 0, 0, 0))
+            _append_word(data, word.GetUTF8Text(RIL.WORD) or "", word.Confidence(RIL.WORD), bbox)
+
+    return data
+
+
+def find_numbers(data, pattern, min_conf=60):
+    """
+    Find pattern in image_to_data output, letting a match span several words (Tesseract
+    reads '1234 5678 9012' as three). The words are joined into one text, with line starts
+    marked so matches never cross lines, and scanned in a single pass. A match only counts
+    when every word it spans has conf above min_conf. Returns (text, (first, last), conf)
+    per match, with the indexes of the first and last word it spans.
+    """
+    words = [word.strip() or LINE_BREAK for word in data["text"]]
+    word_starts, offset = [], 0
+    for word in words:
+        word_starts.append(offset)
+        offset += len(word) + 1
+
+    numbers = []
+    for match in pattern.finditer(" ".join(words)):
+        first = bisect.bisect_right(word_starts, match.start()) - 1
+        last = bisect.bisect_right(word_starts, match.end() - 1) - 1
+        conf = min(int(c) for c in data["conf"][first:last + 1])
+        if conf > min_conf:
+            numbers.append((match.group(), (first, last), conf))
+    return numbers
+
+
+def _append_word(data, text, conf, bbox):
+    x1, y1, x2, y2 = bbox
+    data["text"].append(text)
+    data["conf"].append(conf)
+    data["left"].append(x1)
+    data["top"].append(y1)
+    data["width"].append(x2 - x1)
+    data["height"].append(y2 - y1)